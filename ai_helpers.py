@@ -1,13 +1,44 @@
 # ai_helpers.py — robust, example-friendly answers with chat history
 import os
-from typing import Dict, List, Optional
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
 
 try:
     import streamlit as st  # optional, only for st.secrets
 except Exception:
     st = None
 
-from openai import OpenAI, APIError, RateLimitError
+try:
+    import tiktoken  # optional, exact prompt token counts
+except Exception:
+    tiktoken = None
+
+try:
+    import sqlite_vec  # optional, enables vec_distance_cosine inside sqlite
+except Exception:
+    sqlite_vec = None
+
+from openai import (
+    APIConnectionError,
+    APIError,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from tutor_cache import cache_path
 
 # --- Get API Key ---
 def _get_openai_key() -> str:
@@ -20,33 +51,420 @@ def _get_openai_key() -> str:
     return key
 
 
-_client: Optional[OpenAI] = None
+# --- Streamlit caches (no-ops / plain memo without Streamlit) ---
+def _cache_data(**kwargs):
+    """st.cache_data when Streamlit is available, otherwise a no-op decorator."""
+    if st is None:
+        return lambda fn: fn
+    return st.cache_data(**kwargs)
+
+
+def _cache_resource(fn):
+    """st.cache_resource when Streamlit is available, otherwise a process-wide memo."""
+    if st is None:
+        return lru_cache(maxsize=None)(fn)
+    return st.cache_resource(show_spinner=False)(fn)
+
+
+@_cache_resource
+def get_client() -> OpenAI:
+    """Shared OpenAI client (one pooled HTTP connection set per process)."""
+    key = _get_openai_key()
+    if not key:
+        raise RuntimeError("OPENAI_API_KEY not set (env or .streamlit/secrets.toml).")
+    # retries are handled by _completion, not the SDK
+    return OpenAI(api_key=key, max_retries=0)
+
+
+# --- Retries ---
+_RETRYABLE = (RateLimitError, APIConnectionError, InternalServerError)
+_backoff = wait_random_exponential(min=1, max=30)
+
+
+def _wait_retry_after(retry_state) -> float:
+    """
+    Honor the server's Retry-After header when present, else jittered exponential backoff.
+    Works for a raised API error and for a returned (retryable) HTTP response alike.
+    """
+    outcome = retry_state.outcome
+    response = getattr(outcome.exception(), "response", None) if outcome.failed else outcome.result()
+    try:
+        return min(float(response.headers["retry-after"]), 30.0)
+    except Exception:
+        return _backoff(retry_state)
+
+
+def _notify_retry(retry_state) -> None:
+    if st is None:
+        return
+    try:
+        st.toast(f"Service busy — retrying (attempt {retry_state.attempt_number + 1} of 5)…")
+    except Exception:
+        pass
+
+
+_RETRY_POLICY = dict(
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type(_RETRYABLE),
+    before_sleep=_notify_retry,
+    reraise=True,
+)
+
+
+# --- Outbound throttling ---
+class RateLimiter:
+    """
+    Client-side limits for OpenAI calls: caps in-flight requests and spreads
+    requests/tokens over a rolling minute so bursts queue instead of hitting 429s.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_requests: int = 5,
+        requests_per_minute: int = 200,
+        tokens_per_minute: int = 40000,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._slots = threading.BoundedSemaphore(max_concurrent_requests)
+        self._lock = threading.Lock()
+        self._requests_left = float(requests_per_minute)
+        self._tokens_left = float(tokens_per_minute)
+        self._stamp = time.monotonic()
+
+    def _reserve(self, tokens: int) -> float:
+        """Book one request + `tokens`; return how long to wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._stamp
+            self._stamp = now
+            rpm, tpm = self.requests_per_minute, self.tokens_per_minute
+            self._requests_left = min(rpm, self._requests_left + elapsed * rpm / 60.0)
+            self._tokens_left = min(tpm, self._tokens_left + elapsed * tpm / 60.0)
+            # buckets may go negative; the debt is what later callers wait out
+            self._requests_left -= 1
+            self._tokens_left -= min(tokens, tpm)
+            return max(0.0, -self._requests_left * 60.0 / rpm, -self._tokens_left * 60.0 / tpm)
+
+    @contextmanager
+    def limit(self, tokens: int):
+        wait = self._reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        with self._slots:
+            yield
+
+
+_rate_limiter = RateLimiter()
+
+
+@contextmanager
+def _completion(client: OpenAI, tokens: int, **kwargs):
+    """
+    Send a chat completion through the rate limiter and yield the response, keeping its
+    request slot until the block exits (streams are read inside it). Each retry books
+    the limiter again, and no slot is held while backing off.
+    """
+    for attempt in Retrying(**_RETRY_POLICY):
+        with attempt, ExitStack() as held:
+            held.enter_context(_rate_limiter.limit(tokens))
+            response = client.chat.completions.create(**kwargs)
+            slot = held.pop_all()
+    with slot:
+        yield response
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        pass
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # BPE files can't be fetched (e.g. no network): use ~4 chars/token.
+        # lru_cache keeps this None, so the download isn't retried per call.
+        return None
+
+
+def _estimate_tokens(messages: List[Dict[str, str]], model: str, max_tokens: int) -> int:
+    """Prompt tokens (tiktoken, or ~4 chars/token without it) plus the completion budget."""
+    text = "".join(m["content"] for m in messages)
+    enc = _encoding(model)
+    prompt_tokens = len(enc.encode(text)) if enc is not None else len(text) // 4
+    return prompt_tokens + max_tokens
+
+
+# --- Exact answer cache ---
+# Lives on the module so it survives Streamlit script reruns.
+_ANSWER_CACHE_SIZE = 512
+_answer_cache: "OrderedDict[str, str]" = OrderedDict()
+_answer_cache_lock = threading.Lock()
+
+def _answer_key(
+    model: str,
+    chapter: str,
+    user_q: str,
+    system_preamble: str,
+    temperature: float,
+    max_tokens: int,
+    chat_history: Optional[List[Dict[str, str]]],
+) -> str:
+    history = [(m.get("role", "user"), m.get("content", "") or "") for m in chat_history or []]
+    payload = json.dumps(
+        [model, chapter, user_q.strip().lower(), system_preamble, temperature, max_tokens, history],
+        ensure_ascii=False,
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _answer_cache_get(key: str) -> Optional[str]:
+    with _answer_cache_lock:
+        answer = _answer_cache.get(key)
+        if answer is not None:
+            _answer_cache.move_to_end(key)
+        return answer
+
+
+def _answer_cache_put(key: str, answer: str) -> None:
+    with _answer_cache_lock:
+        _answer_cache[key] = answer
+        _answer_cache.move_to_end(key)
+        while len(_answer_cache) > _ANSWER_CACHE_SIZE:
+            _answer_cache.popitem(last=False)
+
+
+# --- Semantic answer cache ---
+class SemanticCache:
+    """
+    Reuse answers for near-identical questions on the same chapter.
+
+    Questions are embedded once; rows are namespaced per (chapter, model, preamble)
+    so a hit is only returned for the same chapter and answer style.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        embed_model: str = "text-embedding-3-small",
+        max_distance: float = 0.12,
+        ttl_seconds: int = 7 * 24 * 3600,
+        max_rows_per_namespace: int = 2000,
+    ):
+        self.embed_model = embed_model
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self.max_rows_per_namespace = max_rows_per_namespace
+        self._lock = threading.Lock()
+        path = path or os.getenv("TUTOR_SEMANTIC_CACHE") or cache_path("tutor_semantic_cache.sqlite3")
+        if path is None:
+            raise OSError("no private cache dir for the semantic cache")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._use_vec = False
+        if sqlite_vec is not None:
+            try:
+                self._conn.enable_load_extension(True)
+                sqlite_vec.load(self._conn)
+                self._conn.enable_load_extension(False)
+                self._use_vec = True
+            except Exception:
+                self._use_vec = False
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "namespace TEXT, question TEXT, embedding BLOB, answer TEXT, expires_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_ns ON answers(namespace)")
+        self._conn.commit()
+
+    @staticmethod
+    def namespace(chapter: str, model: str, system_preamble: str) -> str:
+        digest = hashlib.blake2b(
+            (model + "\0" + system_preamble).encode("utf-8"), digest_size=8
+        ).hexdigest()
+        return f"{chapter}:{digest}"
 
-def _client_once() -> OpenAI:
-    global _client
-    if _client is None:
-        key = _get_openai_key()
-        if not key:
-            raise RuntimeError("OPENAI_API_KEY not set (env or .streamlit/secrets.toml).")
-        _client = OpenAI(api_key=key)
-    return _client
+    def embed(self, client: OpenAI, question: str) -> array:
+        resp = client.embeddings.create(model=self.embed_model, input=question)
+        vec = resp.data[0].embedding
+        norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+        return array("f", (x / norm for x in vec))
+
+    def lookup(self, namespace: str, vec: array) -> Optional[str]:
+        now = time.time()
+        best: Optional[Tuple[str, float]] = None
+        with self._lock:
+            if self._use_vec:
+                row = self._conn.execute(
+                    "SELECT answer, vec_distance_cosine(embedding, ?) AS d FROM answers "
+                    "WHERE namespace = ? AND expires_at > ? AND length(embedding) = ? "
+                    "ORDER BY d LIMIT 1",
+                    (vec.tobytes(), namespace, now, len(vec) * vec.itemsize),
+                ).fetchone()
+                best = (row[0], row[1]) if row else None
+            else:
+                rows = self._conn.execute(
+                    "SELECT answer, embedding FROM answers "
+                    "WHERE namespace = ? AND expires_at > ? AND length(embedding) = ?",
+                    (namespace, now, len(vec) * vec.itemsize),
+                ).fetchall()
+        if not self._use_vec and rows:
+            # scored outside the lock, as one float32 matrix-vector product;
+            # both sides are unit length, so cosine distance is 1 - dot
+            matrix = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.float32)
+            dots = matrix.reshape(len(rows), len(vec)) @ np.frombuffer(vec, dtype=np.float32)
+            i = int(dots.argmax())
+            best = (rows[i][0], 1.0 - float(dots[i]))
+        if best is not None and best[1] < self.max_distance:
+            return best[0]
+        return None
+
+    def store(self, namespace: str, question: str, vec: array, answer: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "INSERT INTO answers (namespace, question, embedding, answer, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (namespace, question, vec.tobytes(), answer, now + self.ttl_seconds),
+            )
+            # keep each namespace bounded: drop the rows closest to expiry
+            self._conn.execute(
+                "DELETE FROM answers WHERE namespace = ? AND rowid NOT IN ("
+                "SELECT rowid FROM answers WHERE namespace = ? ORDER BY expires_at DESC LIMIT ?)",
+                (namespace, namespace, self.max_rows_per_namespace),
+            )
+            self._conn.commit()
+
+
+_semantic_cache: Optional[SemanticCache] = None
+
+def _semantic_cache_once() -> Optional[SemanticCache]:
+    global _semantic_cache
+    if _semantic_cache is None:
+        try:
+            _semantic_cache = SemanticCache()
+        except Exception:
+            return None
+    return _semantic_cache
+
+
+def _normalize_question(user_q: str) -> str:
+    return " ".join(user_q.lower().split())
+
+
+def _semantic_probe(
+    chapter: str,
+    model: str,
+    system_preamble: str,
+    user_q: str,
+    chat_history: Optional[List[Dict[str, str]]],
+) -> Tuple[Optional[str], Optional[Tuple[SemanticCache, str, array]]]:
+    """
+    Look the question up in the semantic cache.
+    Returns (cached answer or None, handle for _remember or None).
+    Only history-free questions are cached: with history the answer depends
+    on the conversation, not just the question.
+    """
+    if chat_history:
+        return None, None
+    cache = _semantic_cache_once()
+    if cache is None:
+        return None, None
+    try:
+        ns = SemanticCache.namespace(chapter, model, system_preamble)
+        vec = cache.embed(get_client(), _normalize_question(user_q))
+        return cache.lookup(ns, vec), (cache, ns, vec)
+    except Exception:
+        return None, None
+
+
+def _remember(
+    exact_key: str,
+    semantic: Optional[Tuple[SemanticCache, str, array]],
+    user_q: str,
+    answer: str,
+) -> None:
+    if not answer:
+        return
+    _answer_cache_put(exact_key, answer)
+    if semantic is not None:
+        cache, ns, vec = semantic
+        try:
+            cache.store(ns, _normalize_question(user_q), vec, answer)
+        except Exception:
+            pass
 
 
 # --- Context builder ---
+# history messages are re-counted on every turn; remember their sizes
+@lru_cache(maxsize=4096)
+def _count_tokens(text: str, model: str) -> int:
+    enc = _encoding(model)
+    return len(enc.encode(text)) if enc is not None else len(text) // 4 + 1
+
+
+def _truncate_tokens(text: str, limit: int, model: str) -> str:
+    enc = _encoding(model)
+    if enc is None:
+        return text if len(text) <= limit * 4 else text[: limit * 4] + "…"
+    ids = enc.encode(text)
+    return text if len(ids) <= limit else enc.decode(ids[:limit]) + "…"
+
+
 def _gather_context(
     chapter: str,
     chapter_summaries: Dict[str, str],
     chapter_questions: Dict[str, List[str]],
     chapter_answers: Dict[str, List[str]],
     chat_history: Optional[List[Dict[str, str]]] = None,
-    max_chars: int = 8000,
-) -> str:
+    model: str = "gpt-4o-mini",
+    summary_budget: int = 1200,
+    qa_budget: int = 600,
+    history_budget: int = 1500,
+) -> Tuple[str, List[Dict[str, str]]]:
     """
-    Build a compact context block from the selected chapter and optional chat history.
+    Build the chapter context block and the recent chat messages for a prompt.
+    The context block depends only on the chapter, so it is byte-identical across
+    questions; history keeps as many recent messages as fit in `history_budget` tokens.
     """
-    summary = (chapter_summaries.get(chapter, "") or "").strip()
-    qs = chapter_questions.get(chapter, []) or []
-    ans = chapter_answers.get(chapter, []) or []
+    recent: List[Dict[str, str]] = []
+    used = 0
+    for m in reversed(chat_history or []):
+        content = (m.get("content", "") or "").strip()
+        if not content:
+            continue
+        used += _count_tokens(content, model)
+        if used > history_budget:
+            break
+        role = m.get("role", "user")
+        recent.append({"role": role if role in ("user", "assistant") else "user", "content": content})
+    recent.reverse()
+
+    context = _build_context(
+        chapter_summaries.get(chapter, "") or "",
+        tuple(chapter_questions.get(chapter, []) or []),
+        tuple(chapter_answers.get(chapter, []) or []),
+        model,
+        summary_budget,
+        qa_budget,
+    )
+    return context, recent
+
+
+@_cache_data(max_entries=256, show_spinner=False)
+def _build_context(
+    summary: str,
+    qs: Tuple[str, ...],
+    ans: Tuple[str, ...],
+    model: str,
+    summary_budget: int,
+    qa_budget: int,
+) -> str:
+    summary = _truncate_tokens(summary.strip(), summary_budget, model) if summary.strip() else ""
 
     # Pair top Q/A safely
     pairs: List[str] = []
@@ -57,47 +475,110 @@ def _gather_context(
             pairs.append("Q: " + q + "\nA: " + a)
 
     qa_block = "\n\n".join(pairs).strip()
+    if qa_block:
+        qa_block = _truncate_tokens(qa_block, qa_budget, model)
 
     pieces: List[str] = []
     if summary:
         pieces.append("Chapter Summary:\n" + summary)
     if qa_block:
         pieces.append("Sample Q&A:\n" + qa_block)
-
-    # Include recent chat context (optional)
-    if chat_history:
-        # keep only recent, short messages
-        recent = chat_history[-8:]
-        # flatten to simple text to avoid structured tokens in context
-        chat_lines = []
-        for m in recent:
-            role = m.get("role", "user")
-            content = (m.get("content", "") or "").strip()
-            if content:
-                chat_lines.append(f"{role}: {content}")
-        if chat_lines:
-            pieces.append("Recent Conversation:\n" + "\n".join(chat_lines))
-
-    context = "\n\n".join(pieces).strip()
-    if len(context) > max_chars:
-        context = context[:max_chars] + "…"
-    return context
+    return "\n\n".join(pieces).strip()
 
 
 # --- Main function ---
+DEFAULT_SYSTEM_PREAMBLE = (
+    "You are an intelligent, friendly textbook tutor. "
+    "Use the chapter content as your main guide, but you may also use general world knowledge "
+    "to provide simple real-world examples or analogies. "
+    "Explain concepts clearly and make them easy to understand. "
+    "If the context does not contain the answer, say you’re unsure and suggest where to look."
+)
+
+
+def _build_messages(
+    user_q: str,
+    context: str,
+    history: List[Dict[str, str]],
+    system_preamble: str,
+) -> List[Dict[str, str]]:
+    """
+    Stable prefix first (system, chapter context, acknowledgement), then the
+    conversation and the question, so repeated questions on a chapter share a
+    prompt prefix the API can serve from its prompt cache.
+    """
+    context_block = (
+        "Below is relevant textbook content for this chapter.\n"
+        "Use it to answer the student's questions helpfully and with clarity. "
+        "Prefer short, concrete examples.\n\n"
+        "Context:\n" + context
+    )
+    return [
+        {"role": "system", "content": system_preamble},
+        {"role": "user", "content": context_block},
+        {"role": "assistant", "content": "Understood."},
+        *history,
+        {"role": "user", "content": user_q},
+    ]
+
+
+def _error_answer(e: Exception) -> str:
+    if isinstance(e, RateLimitError):
+        return "I’m hitting request limits right now. Please try again in a few seconds."
+    if isinstance(e, APIError):
+        return f"API error: {e}"
+    return f"Sorry — I couldn't generate an answer right now ({e})."
+
+
+def _prepare_answer(
+    user_q: str,
+    chapter: str,
+    chapter_summaries: Dict[str, str],
+    chapter_questions: Dict[str, List[str]],
+    chapter_answers: Dict[str, List[str]],
+    system_preamble: str,
+    temperature: float,
+    model: str,
+    chat_history: Optional[List[Dict[str, str]]],
+    max_tokens: int,
+) -> Tuple[
+    str,
+    Optional[str],
+    Optional[List[Dict[str, str]]],
+    Optional[Tuple[SemanticCache, str, array]],
+]:
+    """
+    Steps shared by answer_with_ai and answer_with_ai_stream.
+    Returns (exact_key, cached, messages, semantic): `cached` is a ready answer from the
+    exact or semantic cache (messages is then None); otherwise `messages` is the prompt
+    and `semantic` is what _remember needs to store the new answer.
+    """
+    exact_key = _answer_key(
+        model, chapter, user_q, system_preamble, temperature, max_tokens, chat_history
+    )
+    cached = _answer_cache_get(exact_key)
+    if cached is not None:
+        return exact_key, cached, None, None
+
+    context, history = _gather_context(
+        chapter, chapter_summaries, chapter_questions, chapter_answers, chat_history, model
+    )
+
+    cached, semantic = _semantic_probe(chapter, model, system_preamble, user_q, chat_history)
+    if cached is not None:
+        _answer_cache_put(exact_key, cached)
+        return exact_key, cached, None, None
+
+    return exact_key, None, _build_messages(user_q, context, history, system_preamble), semantic
+
+
 def answer_with_ai(
     user_q: str,
     chapter: str,
     chapter_summaries: Dict[str, str],
     chapter_questions: Dict[str, List[str]],
     chapter_answers: Dict[str, List[str]],
-    system_preamble: str = (
-        "You are an intelligent, friendly textbook tutor. "
-        "Use the chapter content as your main guide, but you may also use general world knowledge "
-        "to provide simple real-world examples or analogies. "
-        "Explain concepts clearly and make them easy to understand. "
-        "If the context does not contain the answer, say you’re unsure and suggest where to look."
-    ),
+    system_preamble: str = DEFAULT_SYSTEM_PREAMBLE,
     temperature: float = 0.5,
     model: str = "gpt-4o-mini",
     chat_history: Optional[List[Dict[str, str]]] = None,
@@ -110,33 +591,79 @@ def answer_with_ai(
     if not user_q:
         return "Please ask a question."
 
-    context = _gather_context(
-        chapter, chapter_summaries, chapter_questions, chapter_answers, chat_history
+    exact_key, cached, messages, semantic = _prepare_answer(
+        user_q, chapter, chapter_summaries, chapter_questions, chapter_answers,
+        system_preamble, temperature, model, chat_history, max_tokens,
     )
+    if cached is not None:
+        return cached
 
-    user_prompt = (
-        "Below is relevant textbook content and any previous discussion.\n"
-        "Use this to answer the student's question helpfully and with clarity. "
-        "Prefer short, concrete examples.\n\n"
-        "Context:\n" + context + "\n\n"
-        "Question: " + user_q
+    try:
+        client = get_client()
+        with _completion(
+            client,
+            _estimate_tokens(messages, model, max_tokens),
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            messages=messages,
+        ) as resp:
+            answer = (resp.choices[0].message.content or "").strip()
+        _remember(exact_key, semantic, user_q, answer)
+        return answer
+    except Exception as e:
+        return _error_answer(e)
+
+
+def answer_with_ai_stream(
+    user_q: str,
+    chapter: str,
+    chapter_summaries: Dict[str, str],
+    chapter_questions: Dict[str, List[str]],
+    chapter_answers: Dict[str, List[str]],
+    system_preamble: str = DEFAULT_SYSTEM_PREAMBLE,
+    temperature: float = 0.5,
+    model: str = "gpt-4o-mini",
+    chat_history: Optional[List[Dict[str, str]]] = None,
+    max_tokens: int = 500,
+) -> Iterator[str]:
+    """
+    Streaming variant of answer_with_ai for st.write_stream: yields text as it arrives.
+    Cached answers are yielded in one piece.
+    """
+    user_q = (user_q or "").strip()
+    if not user_q:
+        yield "Please ask a question."
+        return
+
+    exact_key, cached, messages, semantic = _prepare_answer(
+        user_q, chapter, chapter_summaries, chapter_questions, chapter_answers,
+        system_preamble, temperature, model, chat_history, max_tokens,
     )
+    if cached is not None:
+        yield cached
+        return
 
+    parts: List[str] = []
     try:
-        client = _client_once()
-        resp = client.chat.completions.create(
+        client = get_client()
+        with _completion(
+            client,
+            _estimate_tokens(messages, model, max_tokens),
             model=model,
             temperature=temperature,
             max_tokens=max_tokens,
-            messages=[
-                {"role": "system", "content": system_preamble},
-                {"role": "user", "content": user_prompt},
-            ],
-        )
-        return (resp.choices[0].message.content or "").strip()
-    except RateLimitError:
-        return "I’m hitting request limits right now. Please try again in a few seconds."
-    except APIError as e:
-        return f"API error: {e}"
+            messages=messages,
+            stream=True,
+        ) as stream:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    parts.append(delta)
+                    yield delta
     except Exception as e:
-        return f"Sorry — I couldn't generate an answer right now ({e})."
+        yield _error_answer(e)
+        return
+    _remember(exact_key, semantic, user_q, "".join(parts).strip())
@@ -2,11 +2,35 @@
 import os
 import re
 import ast
+import asyncio
+import hashlib
+import io
+import json
+import pickle
 import random
+import time
+from collections import deque
+from itertools import chain, dropwhile
 
 import streamlit as st
-import requests
-import pandas as pd
+from tenacity import (
+    AsyncRetrying,
+    Retrying,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+)
+
+from tutor_cache import cache_path
+
+# pandas, httpx and the challenge UIs are imported inside the views that
+# use them, so the first render doesn't wait on imports the chosen mode never needs
+
+try:
+    import orjson  # optional, much faster list-cell parsing
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # ---------------------------------------------------------
 # Make OPENAI_API_KEY available to ai_helpers via env var
@@ -14,25 +38,109 @@ import pandas as pd
 # ---------------------------------------------------------
 os.environ["OPENAI_API_KEY"] = st.secrets.get("OPENAI_API_KEY", "")
 
-# 👇 import challenge stuff from challenges.py
-from challenges import (
-    init_tutor_state,
-    tutor_sidebar,
-    flashcards_ui,
-    mcq_ui,
-    fill_in_blank_ui,
-    best_qa_match,
-    match_answers_ui,
-    timed_question_ui,
-    scenario_ui,
-    progress_dashboard_ui,   # ✅ dashboard
-)
-
 # --------------- GLOBAL CONFIG -----------------
 st.set_page_config(page_title="Textbook Tutor", layout="wide")
 
 
 # --------------- HELPERS FOR MULTI-BOOK RAG (API view) -----------------
+@st.cache_resource
+def _hx():
+    """One pooled HTTP/2 client for the FastAPI backend, shared across reruns."""
+    import httpx
+
+    # the transport owns the pool; retries=3 re-attempts failed connects,
+    # status-based retries live in _retry_policy
+    transport = httpx.HTTPTransport(
+        http2=True, retries=3, limits=httpx.Limits(max_keepalive_connections=10)
+    )
+    return httpx.Client(transport=transport, timeout=60)
+
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# statuses that mean the request was turned away before any work was done
+_REJECTED_STATUSES = {429, 503}
+
+
+def _retry_policy(idempotent: bool = True) -> dict:
+    """
+    Retry timeouts, dropped connections and 429/5xx responses with jittered backoff.
+    With idempotent=False only failures where the server never started the work are
+    retried (connect errors, 429/503): a read timeout or 500 may mean it is still running.
+    """
+    import httpx
+    from ai_helpers import _notify_retry, _wait_retry_after
+
+    if idempotent:
+        retry_on_error, statuses = httpx.TransportError, _RETRY_STATUSES
+    else:
+        retry_on_error, statuses = (httpx.ConnectError, httpx.ConnectTimeout), _REJECTED_STATUSES
+    return dict(
+        wait=_wait_retry_after,
+        stop=stop_after_attempt(5),
+        retry=(
+            retry_if_exception_type(retry_on_error)
+            | retry_if_result(lambda r: r.status_code in statuses)
+        ),
+        before_sleep=_notify_retry,
+        # out of attempts: hand back the last response (or raise the last error)
+        retry_error_callback=lambda retry_state: retry_state.outcome.result(),
+    )
+
+
+def _post(url: str, idempotent: bool = True, **kwargs):
+    kwargs.setdefault("timeout", 120)
+    return Retrying(**_retry_policy(idempotent))(_hx().post, url, **kwargs)
+
+
+async def _post_all(api: str, bodies: dict) -> dict:
+    """POST to several endpoints concurrently; maps endpoint -> response (or the exception raised)."""
+    import httpx
+
+    async with httpx.AsyncClient(http2=True, timeout=120) as client:
+        names = list(bodies)
+        results = await asyncio.gather(
+            *[
+                AsyncRetrying(**_retry_policy())(client.post, f"{api}/{name}", json=bodies[name])
+                for name in names
+            ],
+            return_exceptions=True,
+        )
+    return dict(zip(names, results))
+
+
+def _show_result(r):
+    """Render a story/case response (or the error it produced)."""
+    if isinstance(r, Exception):
+        st.error(str(r))
+    elif r.is_success:
+        st.write(r.json())
+    else:
+        st.error(r.text)
+
+
+def _show_quiz(r):
+    if isinstance(r, Exception):
+        st.error(str(r))
+    elif r.is_success:
+        items = r.json().get("items", [])
+        for i, it in enumerate(items, 1):
+            st.markdown(f"**Q{i}. {it.get('question','')}**")
+            opts = it.get("options", {})
+            for key, val in opts.items():
+                st.write(f"- {key}. {val}")
+            st.caption(
+                f"Answer: {it.get('correct','?')} | Evidence: {it.get('evidence','')}"
+            )
+    else:
+        st.error(r.text)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_books(api: str):
+    """Library listing, refreshed at most every 30s (cleared right after an ingest)."""
+    return _hx().get(f"{api}/books", timeout=3).json()
+
+
 def multi_book_rag_ui():
     st.title("Textbook Tutor — Multi-Book RAG (New Project)")
 
@@ -44,13 +152,18 @@ def multi_book_rag_ui():
     title = st.text_input("Book title (for display)", value="Untitled Book", key="multi_title")
     if st.button("Ingest PDF", disabled=up is None, key="multi_ingest_btn"):
         if up:
-            resp = requests.post(
+            resp = _post(
                 f"{api}/ingest",
-                files={"file": (up.name, up, "application/pdf")},
+                # ingesting twice duplicates the book: only retry if it never reached the server
+                idempotent=False,
+                # raw bytes, so a retried attempt re-sends the whole file
+                files={"file": (up.name, up.getvalue(), "application/pdf")},
                 data={"book_title": title},
+                timeout=600,
             )
             if resp.status_code == 200:
                 st.success(resp.json())
+                _fetch_books.clear()
             else:
                 st.error(resp.text)
 
@@ -58,7 +171,7 @@ def multi_book_rag_ui():
     with st.sidebar:
         st.header("Library")
         try:
-            books = requests.get(f"{api}/books").json()
+            books = _fetch_books(api)
         except Exception as e:
             st.error(f"API not reachable at {api}. Start FastAPI first. Error: {e}")
             books = {}
@@ -86,8 +199,8 @@ def multi_book_rag_ui():
             "k": k,
             "scope": {"book_ids": chosen_book_ids, "chapter_ids": chapter_choice},
         }
-        r = requests.post(f"{api}/ask", json=body)
-        if r.ok:
+        r = _post(f"{api}/ask", json=body)
+        if r.is_success:
             data = r.json()
             st.write("**Answer**:", data.get("answer"))
             st.write("**Citations**:")
@@ -100,102 +213,168 @@ def multi_book_rag_ui():
 
     # ---- 3) Story / Case / Quiz ----
     st.subheader("3) Story / Case / Quiz")
+    scope = {"book_ids": chosen_book_ids, "chapter_ids": chapter_choice}
+    all_clicked = st.button("Generate all three", key="multi_all_btn")
     col1, col2, col3 = st.columns(3)
+    with col3:
+        n = st.number_input("# MCQs", min_value=3, max_value=15, value=5, step=1, key="multi_n_mcq")
+    bodies = {
+        "story": {"scope": scope, "max_words": 160},
+        "case": {"scope": scope},
+        "quiz": {"scope": scope, "n_mcq": int(n)},
+    }
+
+    # one click, three requests in flight at once: wall time ≈ the slowest one
+    results = asyncio.run(_post_all(api, bodies)) if all_clicked else {}
+
     with col1:
         if st.button("Generate Story", key="multi_story_btn"):
-            body = {
-                "scope": {"book_ids": chosen_book_ids, "chapter_ids": chapter_choice},
-                "max_words": 160,
-            }
-            r = requests.post(f"{api}/story", json=body)
-            if r.ok:
-                st.write(r.json())
-            else:
-                st.error(r.text)
+            results["story"] = _post(f"{api}/story", json=bodies["story"])
+        if "story" in results:
+            _show_result(results["story"])
 
     with col2:
         if st.button("Generate Case", key="multi_case_btn"):
-            body = {"scope": {"book_ids": chosen_book_ids, "chapter_ids": chapter_choice}}
-            r = requests.post(f"{api}/case", json=body)
-            if r.ok:
-                st.write(r.json())
-            else:
-                st.error(r.text)
+            results["case"] = _post(f"{api}/case", json=bodies["case"])
+        if "case" in results:
+            _show_result(results["case"])
 
     with col3:
-        n = st.number_input("# MCQs", min_value=3, max_value=15, value=5, step=1, key="multi_n_mcq")
         if st.button("Build Quiz", key="multi_quiz_btn"):
-            body = {
-                "scope": {"book_ids": chosen_book_ids, "chapter_ids": chapter_choice},
-                "n_mcq": int(n),
-            }
-            r = requests.post(f"{api}/quiz", json=body)
-            if r.ok:
-                items = r.json().get("items", [])
-                for i, it in enumerate(items, 1):
-                    st.markdown(f"**Q{i}. {it.get('question','')}**")
-                    opts = it.get("options", {})
-                    for key, val in opts.items():
-                        st.write(f"- {key}. {val}")
-                    st.caption(
-                        f"Answer: {it.get('correct','?')} | Evidence: {it.get('evidence','')}"
-                    )
-            else:
-                st.error(r.text)
+            results["quiz"] = _post(f"{api}/quiz", json=bodies["quiz"])
+        if "quiz" in results:
+            _show_quiz(results["quiz"])
 
 
 # --------------- SINGLE-TEXTBOOK INTERACTIVE TUTOR -----------------
 DATA_URL = "https://raw.githubusercontent.com/sravani919/AI_Tutor_Interactive_learning/main/Merged_Chapter_Dataset.csv"
+DATA_MIRROR_NAME = "tutor_chapters.parquet"
+DATA_MIRROR_TTL = 24 * 3600  # seconds before the local copy is re-downloaded
+# bump whenever _build_chapter_dicts changes what it returns, so stale pickles are ignored
+CHAPTER_DATA_VERSION = 2
+
+
+def _chapter_source():
+    """
+    Return (raw, df) for the dataset.
+    `raw` is the bytes of a fresh parquet mirror (None when parquet is unavailable);
+    `df` is set only when the CSV had to be downloaded.
+    """
+    mirror = cache_path(DATA_MIRROR_NAME)
+    if mirror is not None:
+        try:
+            if time.time() - os.path.getmtime(mirror) < DATA_MIRROR_TTL:
+                with open(mirror, "rb") as f:
+                    return f.read(), None
+        except OSError:
+            pass  # missing or unreadable mirror: download a fresh copy
+    import pandas as pd
 
-@st.cache_data(show_spinner="Loading chapter dataset...")
-def load_chapter_data():
     df = pd.read_csv(DATA_URL)
-    chapter_summaries = {}
-    chapter_questions = {}
-    chapter_answers = {}
-
-    def clean_answer_from_question(question, answer):
-        q_words = question.lower().split()
-        a_words = answer.strip().split()
-        q_set = set(w.strip(".,?") for w in q_words)
-        start_index = 0
-        for w in a_words:
-            cw = w.lower().strip(".,?")
-            if cw not in q_set:
-                break
-            start_index += 1
-        trimmed = a_words[start_index:]
-        cleaned = " ".join(trimmed).strip()
-        if not cleaned or len(cleaned.split()) <= 3:
-            cleaned = "It refers to " + " ".join(a_words)
-        if cleaned:
-            cleaned = cleaned[0].upper() + cleaned[1:]
-        return cleaned.rstrip(". ")
-
-    for _, row in df.iterrows():
-        chapter = str(row["chapter"])
-        chapter_content = str(row.get("Chapter Content", "")) or "No summary available."
-
+    if mirror is None:
+        return None, df
+    try:
+        # write-then-rename so concurrent sessions never read a partial file
+        tmp_path = f"{mirror}.{os.getpid()}"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, mirror)
+        with open(mirror, "rb") as f:
+            return f.read(), df
+    except Exception:
+        return None, df  # no parquet engine or read-only cache dir: keep working from the CSV
+
+
+def _safe_literal_eval(cell):
+    """Parse a list-valued CSV cell: JSON first (fast path), Python literal syntax as fallback."""
+    if not isinstance(cell, str):
+        return list(cell) if isinstance(cell, (list, tuple)) else []
+    try:
+        value = _json_loads(cell)
+    except ValueError:
         try:
-            questions = ast.literal_eval(row["Questions"]) if isinstance(row["Questions"], str) else row["Questions"]
+            value = ast.literal_eval(cell)
         except Exception:
-            questions = []
+            return []
+    return list(value) if isinstance(value, (list, tuple)) else []
+
+
+def clean_answer_from_question(question, answer):
+    q_set = {w.strip(".,?") for w in question.lower().split()}
+    a_words = answer.strip().split()
+    # drop the leading answer words that only echo the question
+    trimmed = list(dropwhile(lambda w: w.lower().strip(".,?") in q_set, a_words))
+    cleaned = " ".join(trimmed)
+    if not cleaned or len(trimmed) <= 3:
+        cleaned = "It refers to " + " ".join(a_words)
+    if cleaned:
+        cleaned = cleaned[0].upper() + cleaned[1:]
+    return cleaned.rstrip(". ")
+
+
+def _build_chapter_dicts(df):
+    import pandas as pd
+
+    # column-wise parsing instead of a per-row iterrows loop
+    chapters = df["chapter"].astype(str)
+    if "Chapter Content" in df:
+        contents = df["Chapter Content"].fillna("").astype(str).replace("", "No summary available.")
+    else:
+        contents = pd.Series("No summary available.", index=df.index)
+    # per-chapter Q/A are stored as tuples: immutable, compact, and passed to the
+    # cached context builder in ai_helpers without another copy
+    questions = df["Questions"].map(_safe_literal_eval).map(lambda qs: tuple(qs[:5]))
+    answers = df["Answers"].map(_safe_literal_eval).map(lambda ans: ans[:5])
+    cleaned_answers = [
+        tuple(clean_answer_from_question(q, a) for q, a in zip(qs, ans))
+        for qs, ans in zip(questions, answers)
+    ]
+
+    chapter_summaries = dict(zip(chapters, contents))
+    chapter_questions = dict(zip(chapters, questions))
+    chapter_answers = dict(zip(chapters, cleaned_answers))
+    return chapter_summaries, chapter_questions, chapter_answers
+
+
+# cache_resource: one shared copy per process, no per-rerun unpickling (callers never mutate it)
+@st.cache_resource(show_spinner="Loading chapter dataset...")
+def load_chapter_data():
+    raw, df = _chapter_source()
+    if raw is None:
+        return _build_chapter_dicts(df)
+
+    # the derived dicts are a pure function of the dataset bytes and the build code:
+    # reuse them across restarts
+    digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    artifact = cache_path(f"tutor_v{CHAPTER_DATA_VERSION}_{digest}.pkl")
+    if artifact is not None:
         try:
-            answers = ast.literal_eval(row["Answers"]) if isinstance(row["Answers"], str) else row["Answers"]
+            with open(artifact, "rb") as f:
+                return pickle.load(f)
         except Exception:
-            answers = []
+            pass
 
-        chapter_summaries[chapter] = chapter_content
-        q5 = questions[:5] if questions else []
-        chapter_questions[chapter] = q5
-        cleaned_answers = [clean_answer_from_question(q, a) for q, a in zip(q5, answers[:5])] if questions and answers else []
-        chapter_answers[chapter] = cleaned_answers
+    if df is None:
+        import pandas as pd  # only on a pickle miss; the hit path never needs pandas
+
+        df = pd.read_parquet(io.BytesIO(raw))
+    data = _build_chapter_dicts(df)
+    if artifact is None:
+        return data
+    try:
+        tmp_path = f"{artifact}.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, artifact)
+    except OSError:
+        pass
+    return data
 
-    return chapter_summaries, chapter_questions, chapter_answers
+
+_CHAPTER_NUM_RE = re.compile(r"^\d+(?:\.\d+)?\s*")
 
 
 def clean_chapter_name(chapter_name: str) -> str:
-    return re.sub(r"^\d+(\.\d+)?\s*", "", str(chapter_name)).strip()
+    return _CHAPTER_NUM_RE.sub("", str(chapter_name)).strip()
 
 
 def generate_business_case(chapter: str, chapter_summaries):
@@ -282,7 +461,43 @@ By the end of the week, {name} realizes that <b>{cleaned}</b> isn’t just theor
 
 
 # ---- Interactive Tutor main UI ----
+# Messages kept per chapter in the live chat; older ones fall off the front.
+# The model only sees what fits its token budget anyway (see ai_helpers).
+CHAT_HISTORY_MAX = 64
+
+# Answer style -> system preamble for the chat mode (order = dropdown order)
+_PREAMBLES = {
+    "Concise (default)": (
+        "You are a helpful textbook tutor. "
+        "Answer clearly and concisely in 4–8 sentences. "
+        "Use the provided chapter context and (optionally) the conversation history. "
+        "If the answer is not in the context, say you’re unsure and suggest where to look."
+    ),
+    "Step-by-step (brief)": (
+        "You are a textbook tutor. Provide a brief, step-by-step explanation (3–6 steps) "
+        "grounded in the chapter context (and history if enabled). "
+        "If unsure, say so and point to a likely section."
+    ),
+    "Examples first": (
+        "You are a textbook tutor. Start with a simple real-world example, then explain the concept succinctly. "
+        "Use the chapter context (and history if enabled). If unsure, say so."
+    ),
+}
+
+
 def interactive_tutor_ui():
+    from challenges import (
+        init_tutor_state,
+        tutor_sidebar,
+        flashcards_ui,
+        mcq_ui,
+        fill_in_blank_ui,
+        match_answers_ui,
+        timed_question_ui,
+        scenario_ui,
+        progress_dashboard_ui,   # ✅ dashboard
+    )
+
     init_tutor_state()
     state = st.session_state.tutor
     tutor_sidebar()
@@ -402,7 +617,7 @@ def interactive_tutor_ui():
 
         # --- session storage for chats (persist across reruns) ---
         if "chat_history" not in st.session_state:
-            # { chapter_key: [ {role, content}, ... ] }
+            # { chapter_key: deque([ {role, content}, ... ], maxlen=CHAT_HISTORY_MAX) }
             st.session_state.chat_history = {}
         if "chat_archives" not in st.session_state:
             # { chapter_key: [ [msg,msg,...], [msg,msg,...], ... ] }
@@ -410,7 +625,7 @@ def interactive_tutor_ui():
 
         chapter_key = state["chapter"]
         if chapter_key not in st.session_state.chat_history:
-            st.session_state.chat_history[chapter_key] = []
+            st.session_state.chat_history[chapter_key] = deque(maxlen=CHAT_HISTORY_MAX)
         if chapter_key not in st.session_state.chat_archives:
             st.session_state.chat_archives[chapter_key] = []
 
@@ -426,39 +641,22 @@ def interactive_tutor_ui():
             if st.button("🆕 New chat", help="Archive current chat and start fresh (per chapter)."):
                 current = st.session_state.chat_history[chapter_key]
                 if current:
-                    st.session_state.chat_archives[chapter_key].append(current.copy())
-                st.session_state.chat_history[chapter_key] = []
+                    st.session_state.chat_archives[chapter_key].append(list(current))
+                current.clear()
                 # no explicit rerun; button press already reruns the script
         with c4:
             if st.button("🗑️ Clear chat", help="Delete the current chat messages (per chapter)."):
-                st.session_state.chat_history[chapter_key] = []
+                st.session_state.chat_history[chapter_key].clear()
                 # no explicit rerun needed
 
         # --- answer style ---
         sys_style = st.selectbox(
             "Answer style",
-            ["Concise (default)", "Step-by-step (brief)", "Examples first"],
+            list(_PREAMBLES),
             index=0,
             help="Changes the AI's tone/instructions",
         )
-        if sys_style == "Concise (default)":
-            system_preamble = (
-                "You are a helpful textbook tutor. "
-                "Answer clearly and concisely in 4–8 sentences. "
-                "Use the provided chapter context and (optionally) the conversation history. "
-                "If the answer is not in the context, say you’re unsure and suggest where to look."
-            )
-        elif sys_style == "Step-by-step (brief)":
-            system_preamble = (
-                "You are a textbook tutor. Provide a brief, step-by-step explanation (3–6 steps) "
-                "grounded in the chapter context (and history if enabled). "
-                "If unsure, say so and point to a likely section."
-            )
-        else:  # Examples first
-            system_preamble = (
-                "You are a textbook tutor. Start with a simple real-world example, then explain the concept succinctly. "
-                "Use the chapter context (and history if enabled). If unsure, say so."
-            )
+        system_preamble = _PREAMBLES[sys_style]
 
         # --- show current conversation ---
         st.markdown("##### Current conversation")
@@ -487,23 +685,26 @@ def interactive_tutor_ui():
 
             ai_answer = None
             if use_ai:
-                with st.spinner("Thinking with chapter context…"):
-                    try:
-                        from ai_helpers import answer_with_ai
-                        ai_answer = answer_with_ai(
-                            user_q=user_q,
-                            chapter=state["chapter"],
-                            chapter_summaries=chapter_summaries,
-                            chapter_questions=chapter_questions,
-                            chapter_answers=chapter_answers,
-                            system_preamble=system_preamble,
-                            temperature=0.4,
-                            chat_history=history_for_model,
-                        )
-                        st.markdown("**AI-guided answer (grounded in this chapter):**")
-                        st.write(ai_answer)
-                    except Exception as e:
-                        st.error(f"AI module not available yet. {e}")
+                try:
+                    from ai_helpers import answer_with_ai_stream
+                    st.markdown("**AI-guided answer (grounded in this chapter):**")
+                    stream = answer_with_ai_stream(
+                        user_q=user_q,
+                        chapter=state["chapter"],
+                        chapter_summaries=chapter_summaries,
+                        chapter_questions=chapter_questions,
+                        chapter_answers=chapter_answers,
+                        system_preamble=system_preamble,
+                        temperature=0.4,
+                        chat_history=history_for_model,
+                    )
+                    # keep a spinner up until the first token (prompt building, retries, queueing)
+                    with st.spinner("Thinking…"):
+                        first = next(stream, "")
+                    # tokens render as they arrive; write_stream returns the full text
+                    ai_answer = st.write_stream(chain([first], stream))
+                except Exception as e:
+                    st.error(f"AI module not available yet. {e}")
             else:
                 st.caption("AI is off. Toggle it on to get a grounded answer from ChatGPT.")
 
@@ -1,11 +1,22 @@
 # challenges.py
 
 import streamlit as st
+import io
 import random
 import re
+import sys
 import time
-import matplotlib.pyplot as plt
-from difflib import SequenceMatcher
+import types
+from collections import defaultdict, deque, namedtuple
+from functools import lru_cache
+from itertools import islice, permutations
+
+
+# ----------------- PATTERNS -----------------
+
+_CHAPTER_NUM_RE = re.compile(r"^\d+(?:\.\d+)?\s*")
+_WORD_RE = re.compile(r"\b\w+\b")
+_QUESTION_PREFIX_RE = re.compile(r"\bwhat is\b|\bhow can\b|\bdescribe\b|\bexplain\b", re.IGNORECASE)
 
 
 # ----------------- XP CONFIG -----------------
@@ -19,45 +30,98 @@ XP_PER_CHALLENGE = {
     "Scenario-Based (with Hint)": 15,
 }
 
+# matches the label at the start of a history entry ("MCQ Quiz +10 XP")
+_HISTORY_LABEL_RE = re.compile("^(" + "|".join(re.escape(l) for l in XP_PER_CHALLENGE) + ")")
+
+
+HISTORY_MAX = 500  # activity entries kept; older ones fall off the front
+
 
 # ----------------- STATE INIT -----------------
 
+# Read-only schema of the tutor state. Mutable fields (history, xp_by_challenge,
+# mcq_options) are None here and built fresh per session in init_tutor_state,
+# so sessions never share a container.
+_DEFAULT_TUTOR_STATE = types.MappingProxyType({
+    "name": "",
+    "chapter": None,
+    "mode": None,
+    "xp": 0,
+    "level": 1,
+    "history": None,
+    "challenges_completed": 0,  # not capped like history
+    "xp_by_challenge": None,  # label -> XP, kept by award_xp
+
+    # Flashcards
+    "flashcard_index": 0,
+    "flashcard_flipped": False,
+
+    # MCQ
+    "mcq_index": 0,
+    "mcq_score": 0,
+    "mcq_options": None,  # <-- shuffled answer-pool indices per (chapter, question)
+    "mcq_feedback": None,
+
+    # Fill in the blank (typing)
+    "fib_chapter": None,
+    "fib_order": None,
+    "fib_index": 0,
+    "fib_lives": 3,
+    "fib_attempts": 0,
+
+    # Match answers
+    "match_answers": None,
+
+    # Timed questions
+    "timed": None,
+
+    # Scenario-based
+    "scenario": None,
+})
+
+
 def init_tutor_state():
     """
     Ensure st.session_state.tutor exists with all the fields we use.
     Can be called from app.py before using any challenge.
     """
     if "tutor" not in st.session_state:
-        st.session_state.tutor = {
-            "name": "",
-            "chapter": None,
-            "mode": None,
-            "xp": 0,
-            "level": 1,
-            "history": [],
-
-            # Flashcards
-            "flashcard_index": 0,
-            "flashcard_flipped": False,
-
-            # MCQ
-            "mcq_index": 0,
-            "mcq_score": 0,
-            "mcq_options": {},  # <-- store shuffled options per (chapter, question)
-
-            # Fill in the blank (typing)
-            "fib_index": 0,
-            "fib_lives": 3,
-
-            # Match answers
-            "match_answers": None,
-
-            # Timed questions
-            "timed": None,
-
-            # Scenario-based
-            "scenario": None,
-        }
+        state = dict(_DEFAULT_TUTOR_STATE)
+        state["history"] = deque(maxlen=HISTORY_MAX)
+        state["xp_by_challenge"] = defaultdict(int)
+        state["mcq_options"] = {}
+        st.session_state.tutor = state
+    elif not _DEFAULT_TUTOR_STATE.keys() <= st.session_state.tutor.keys():
+        _upgrade_tutor_state(st.session_state.tutor)
+
+
+def _upgrade_tutor_state(state):
+    """Bring a session started under an older schema up to _DEFAULT_TUTOR_STATE."""
+    history = state.get("history") or ()
+    if "xp_by_challenge" not in state:
+        # rebuild the per-challenge XP counter from the activity strings
+        xp_by_challenge = defaultdict(int)
+        for entry in history:
+            m = _HISTORY_LABEL_RE.match(entry)
+            if m:
+                xp_by_challenge[m.group(1)] += XP_PER_CHALLENGE[m.group(1)]
+        state["xp_by_challenge"] = xp_by_challenge
+    state.setdefault("challenges_completed", len(history))
+    for key, value in _DEFAULT_TUTOR_STATE.items():
+        state.setdefault(key, value)
+
+    # mutable containers: fresh per session, in their current types
+    state["history"] = deque(history, maxlen=HISTORY_MAX)
+    state["xp_by_challenge"] = defaultdict(int, state["xp_by_challenge"] or {})
+    # older sessions stored option strings and wall-clock start times;
+    # the quizzes now expect answer-pool indices and time.monotonic()
+    state["mcq_options"] = {}
+    state["mcq_feedback"] = None
+    if state["timed"] is not None:
+        state["timed"]["options"] = {}
+        state["timed"]["start_time"] = None
+        state["timed"]["answered"] = False
+        state["timed"]["feedback"] = ""
 
 
 def award_xp(label: str):
@@ -66,6 +130,8 @@ def award_xp(label: str):
     gain = XP_PER_CHALLENGE.get(label, 5)
     state["xp"] += gain
     state["history"].append(f"{label} +{gain} XP")
+    state["challenges_completed"] += 1
+    state["xp_by_challenge"][label] += gain
 
     # Very simple leveling rule: every 50×level XP
     if state["xp"] >= state["level"] * 50:
@@ -75,23 +141,65 @@ def award_xp(label: str):
 
 # ----------------- SMALL UTIL -----------------
 
+def _tail(dq, k):
+    """Last k items of a deque, oldest first; walks k items from the right end only."""
+    return list(islice(reversed(dq), k))[::-1]
+
+
+@lru_cache(maxsize=32)
+def _lowered_questions(q_tuple):
+    """Lowercased, interned copy of a chapter's questions, computed once per chapter."""
+    return tuple(sys.intern(q.lower()) for q in q_tuple)
+
+
 def best_qa_match(user_q: str, chapter: str, chapter_questions, chapter_answers):
-    """Simple text similarity to find best QA match (for chat mode)."""
+    """
+    Fuzzy text similarity (RapidFuzz Indel normalized similarity) to find best QA match (for chat mode).
+    Same 0..1 scale as difflib's SequenceMatcher.ratio(), but not the same ranking:
+    the two can pick different best questions for the same query.
+    """
+    if len(user_q) < 2:  # nothing meaningful to match on
+        return None, None
     q_list = chapter_questions.get(chapter, [])
     a_list = chapter_answers.get(chapter, [])
     if not q_list or not a_list:
         return None, None
-    scores = []
-    for q in q_list:
-        s = SequenceMatcher(None, user_q.lower(), q.lower()).ratio()
-        scores.append(s)
-    best_idx = max(range(len(scores)), key=lambda i: scores[i])
+    # imported here so the challenge views don't pay for them
+    import numpy as np
+    from rapidfuzz import process
+    from rapidfuzz.distance import Indel
+
+    choices = _lowered_questions(tuple(q_list))
+    # one (1, N) float32 row scored in C
+    scores = process.cdist(
+        [user_q.lower()], choices,
+        scorer=Indel.normalized_similarity,
+        dtype=np.float32,
+    )
+    best_idx = int(scores.argmax())
     return q_list[best_idx], a_list[best_idx]
 
 
+@lru_cache(maxsize=16)
+def _chapter_answer_pool(chapter, a_tuple):
+    """Distinct answers of a chapter and an answer -> index lookup, built once per chapter."""
+    pool = tuple(dict.fromkeys(a_tuple))
+    return pool, {a: i for i, a in enumerate(pool)}
+
+
+def _option_indices(n, correct_idx, k=3):
+    """correct_idx plus up to k distinct other indices from range(n), shuffled."""
+    # sample from the n-1 slots that aren't the answer, then shift past it
+    options = [j + (j >= correct_idx) for j in random.sample(range(n - 1), k=min(k, n - 1))]
+    options.append(correct_idx)
+    random.shuffle(options)
+    return options
+
+
+@lru_cache(maxsize=128)
 def _clean_chapter_name(chapter_name: str) -> str:
     """Local cleaner for scenario titles, independent from app.py."""
-    return re.sub(r"^\d+(\.\d+)?\s*", "", str(chapter_name)).strip()
+    return _CHAPTER_NUM_RE.sub("", str(chapter_name)).strip()
 
 
 # ----------------- SIDEBAR (PROFILE/XP SNAPSHOT) -----------------
@@ -105,7 +213,7 @@ def tutor_sidebar():
     st.sidebar.write(f"**XP:** {state['xp']}")
     if state["history"]:
         st.sidebar.markdown("**Recent activity:**")
-        for h in state["history"][-5:]:
+        for h in _tail(state["history"], 5):
             st.sidebar.caption("• " + h)
 
 
@@ -118,17 +226,32 @@ def tutor_sidebar():
 # 6) SCENARIO-BASED (WITH HINT)
 # -------------------------------------------------
 
+# Button callbacks run before the script reruns, so the click's state change
+# is already visible in the same render -- no extra st.rerun() round-trip.
+
+def _flashcard_flip():
+    st.session_state.tutor["flashcard_flipped"] = True
+
+
+def _flashcard_advance(got_it=False):
+    state = st.session_state.tutor
+    if got_it:
+        award_xp("Flashcards")
+    state["flashcard_index"] += 1
+    state["flashcard_flipped"] = False
+
+
 def flashcards_ui(chapter, chapter_questions, chapter_answers):
     state = st.session_state.tutor
     q_list = chapter_questions.get(chapter, [])
     a_list = chapter_answers.get(chapter, [])
-    pairs = list(zip(q_list, a_list))
-    if not pairs:
+    n = min(len(q_list), len(a_list))
+    if not n:
         st.info("No flashcards available for this chapter yet.")
         return
 
     idx = state["flashcard_index"]
-    if idx >= len(pairs):
+    if idx >= n:
         st.success("You’ve finished all flashcards for this chapter! 🎉")
         if st.button("Restart flashcards", key="flash_restart"):
             state["flashcard_index"] = 0
@@ -136,50 +259,38 @@ def flashcards_ui(chapter, chapter_questions, chapter_answers):
             st.rerun()
         return
 
-    q, a = pairs[idx]
-    st.markdown(f"**Card {idx+1} / {len(pairs)}**")
+    q, a = q_list[idx], a_list[idx]
+    st.markdown(f"**Card {idx+1} / {n}**")
 
     # ---- 1) read current state ----
-    flipped = state.get("flashcard_flipped", False)
-
-    # ---- 2) draw buttons + capture clicks (but don't render Q/A yet) ----
-    flip_clicked = got_it_clicked = next_clicked = False
+    flipped = state["flashcard_flipped"]
 
+    # ---- 2) draw buttons; clicks are handled by the callbacks above ----
     if not flipped:
         # only show flip button
-        flip_clicked = st.button("Flip card", key=f"flip_{idx}")
+        st.button("Flip card", key=f"flip_{idx}", on_click=_flashcard_flip)
     else:
         # show answer + two actions
         col1, col2 = st.columns(2)
         with col1:
-            got_it_clicked = st.button("👍 I got it", key=f"got_{idx}")
+            st.button("👍 I got it", key=f"got_{idx}", on_click=_flashcard_advance, args=(True,))
         with col2:
-            next_clicked = st.button("➡️ Next card", key=f"next_{idx}")
-
-    # ---- 3) update state based on clicks ----
-    if flip_clicked:
-        state["flashcard_flipped"] = True
-        flipped = True
-
-    elif got_it_clicked:
-        award_xp("Flashcards")
-        state["flashcard_index"] += 1
-        state["flashcard_flipped"] = False
-        st.rerun()
+            st.button("➡️ Next card", key=f"next_{idx}", on_click=_flashcard_advance)
 
-    elif next_clicked:
-        state["flashcard_index"] += 1
-        state["flashcard_flipped"] = False
-        st.rerun()
-
-    # ---- 4) now render based on (possibly updated) state ----
-    if not state.get("flashcard_flipped", False):
+    # ---- 3) render based on state ----
+    if not flipped:
         st.write("📘 **Question:**", q)
     else:
         st.write("💡 **Answer:**", a)
 
 
 
+def _mcq_next():
+    state = st.session_state.tutor
+    state["mcq_index"] += 1
+    state["mcq_feedback"] = None
+
+
 def mcq_ui(chapter, chapter_questions, chapter_answers):
     """
     MCQ where options are shuffled ONCE per question,
@@ -189,13 +300,13 @@ def mcq_ui(chapter, chapter_questions, chapter_answers):
     state = st.session_state.tutor
     q_list = chapter_questions.get(chapter, [])
     a_list = chapter_answers.get(chapter, [])
-    pairs = list(zip(q_list, a_list))
-    if not pairs:
+    n = min(len(q_list), len(a_list))
+    if not n:
         st.info("No quiz questions available for this chapter yet.")
         return
 
     idx = state["mcq_index"]
-    if idx >= min(len(pairs), 5):
+    if idx >= min(n, 5):
         st.success(f"🎉 Quiz finished! Score: {state['mcq_score']} / {idx * 10}")
         if st.button("Restart quiz"):
             state["mcq_index"] = 0
@@ -205,32 +316,26 @@ def mcq_ui(chapter, chapter_questions, chapter_answers):
             st.rerun()
         return
 
-    q, correct = pairs[idx]
+    q, correct = q_list[idx], a_list[idx]
     st.markdown(f"**Question {idx+1}**")
     st.write(q)
 
-    # Init dicts
-    if "mcq_options" not in state:
-        state["mcq_options"] = {}
-    if "mcq_feedback" not in state:
-        state["mcq_feedback"] = None
-
     q_key = f"{chapter}_{idx}"
+    mcq_options = state["mcq_options"]
+    pool, idx_by_ans = _chapter_answer_pool(chapter, tuple(a_list))
+    correct_idx = idx_by_ans[correct]
 
     # Create options only once per question
-    if q_key not in state["mcq_options"]:
-        other_answers = [a for a in a_list if a != correct]
-        distractors = random.sample(other_answers, k=min(3, len(other_answers))) if other_answers else []
-        options = [correct] + distractors
-        random.shuffle(options)
-        state["mcq_options"][q_key] = options
+    if q_key not in mcq_options:
+        mcq_options[q_key] = _option_indices(len(pool), correct_idx)
 
-    options = state["mcq_options"][q_key]
-    choice = st.radio("Choose an answer:", options, key=f"mcq_{q_key}")
+    choice = st.radio(
+        "Choose an answer:", mcq_options[q_key], format_func=pool.__getitem__, key=f"mcq_{q_key}"
+    )
 
     # Submit button
     if st.button("Submit", key=f"mcq_submit_{q_key}"):
-        if choice == correct:
+        if choice == correct_idx:
             state["mcq_feedback"] = ("correct", correct)
             award_xp("MCQ Quiz")
             state["mcq_score"] += 10
@@ -238,18 +343,26 @@ def mcq_ui(chapter, chapter_questions, chapter_answers):
             state["mcq_feedback"] = ("wrong", correct)
 
     # Show feedback if available
-    if state["mcq_feedback"]:
-        status, correct_ans = state["mcq_feedback"]
+    feedback = state["mcq_feedback"]
+    if feedback:
+        status, correct_ans = feedback
         if status == "correct":
             st.success(f"✅ Correct! +10 XP\n\nThe right answer was: {correct_ans}")
         else:
             st.error(f"❌ Incorrect. The correct answer was: {correct_ans}")
 
         # Show Next Question button
-        if st.button("➡️ Next Question"):
-            state["mcq_index"] += 1
-            state["mcq_feedback"] = None
-            st.rerun()
+        st.button("➡️ Next Question", on_click=_mcq_next)
+
+def _new_fib_round(state, n_answers):
+    """Reshuffle the fill-in-the-blank order and reset the round counters."""
+    indices = list(range(n_answers))
+    random.shuffle(indices)
+    state["fib_order"] = indices
+    state["fib_index"] = 0
+    state["fib_lives"] = 3
+    state["fib_attempts"] = 0
+
 
 def fill_in_blank_ui(chapter, chapter_answers):
     state = st.session_state.tutor
@@ -259,14 +372,9 @@ def fill_in_blank_ui(chapter, chapter_answers):
         return
 
     # --- initialise / reset order per chapter (shuffled) ---
-    if state.get("fib_chapter") != chapter or "fib_order" not in state:
-        indices = list(range(len(answers)))
-        random.shuffle(indices)
-        state["fib_order"] = indices
+    if state["fib_chapter"] != chapter or state["fib_order"] is None:
+        _new_fib_round(state, len(answers))
         state["fib_chapter"] = chapter
-        state["fib_index"] = 0
-        state["fib_lives"] = 3
-        state["fib_attempts"] = 0
 
     order = state["fib_order"]
     idx = state["fib_index"]
@@ -276,31 +384,34 @@ def fill_in_blank_ui(chapter, chapter_answers):
     if lives <= 0:
         st.error("Game over – you ran out of lives. 💀")
         if st.button("Restart fill-in-the-blank"):
-            indices = list(range(len(answers)))
-            random.shuffle(indices)
-            state["fib_order"] = indices
-            state["fib_index"] = 0
-            state["fib_lives"] = 3
-            state["fib_attempts"] = 0
+            _new_fib_round(state, len(answers))
         return
 
     # finished round
     if idx >= min(len(order), 5):
         st.success("Nice work — you’ve completed the fill-in-the-blank round! 🎉")
         if st.button("Play again"):
-            indices = list(range(len(answers)))
-            random.shuffle(indices)
-            state["fib_order"] = indices
-            state["fib_index"] = 0
-            state["fib_lives"] = 3
-            state["fib_attempts"] = 0
+            _new_fib_round(state, len(answers))
         return
 
     real_idx = order[idx]
     full = answers[real_idx]
+    if len(full) < 5:  # cheap length check before the word scan
+        st.info("This sentence is too short to blank out. Moving on.")
+        state["fib_index"] += 1
+        return
 
-    words = re.findall(r"\b\w+\b", full)
-    keyword = next((w for w in words if len(w) > 4), words[0] if words else None)
+    # first word longer than 4 chars, else the first word; stops at the first hit
+    keyword = first = None
+    for m in _WORD_RE.finditer(full):
+        w = m.group()
+        if first is None:
+            first = w
+        if len(w) > 4:
+            keyword = w
+            break
+    else:
+        keyword = first
     if not keyword:
         st.info("This sentence is too short to blank out. Moving on.")
         state["fib_index"] += 1
@@ -321,27 +432,30 @@ def fill_in_blank_ui(chapter, chapter_answers):
 
     # when user clicks "Check"
     if check_clicked:
-        if guess.strip().lower() == keyword.lower():
+        # lowered once per check; interned so a match compares by identity
+        gk = sys.intern(guess.strip().lower())
+        kk = sys.intern(keyword.lower())
+        if gk == kk:
             st.success(f"✅ Correct! The word was **{keyword}**. +10 XP")
             award_xp("Fill in the Blank")
             state["fib_attempts"] = 0
         else:
-            state["fib_attempts"] += 1
-            state["fib_lives"] -= 1
+            attempts = state["fib_attempts"] = state["fib_attempts"] + 1
+            lives = state["fib_lives"] = lives - 1
 
-            if state["fib_attempts"] == 1:
+            if attempts == 1:
                 st.warning(
                     f"Hint: the word starts with **{keyword[0].upper()}** "
                     f"and has **{len(keyword)}** letters."
                 )
-            elif state["fib_attempts"] >= 2 or state["fib_lives"] <= 0:
+            elif attempts >= 2 or lives <= 0:
                 st.error(f"❌ The correct word was **{keyword}**.")
                 state["fib_attempts"] = 0
                 # move automatically to next question
                 state["fib_index"] += 1
                 return
             else:
-                st.error(f"Not quite. You still have {state['fib_lives']} lives.")
+                st.error(f"Not quite. You still have {lives} lives.")
 
     # when user clicks "Next"
     if next_clicked:
@@ -350,6 +464,21 @@ def fill_in_blank_ui(chapter, chapter_answers):
 
 # ----------------- MATCH THE ANSWERS -----------------
 
+def _new_match_state(chapter, n, round_no=0):
+    """Fresh Match-the-Answers state with a per-(chapter, round) reproducible option order."""
+    # str seeds are hashed deterministically, unlike hash(chapter) under PYTHONHASHSEED
+    perm = list(range(n))
+    random.Random(f"{chapter}:{round_no}").shuffle(perm)
+    return {
+        "chapter": chapter,
+        "round": round_no,
+        "perm": perm,            # option order as indices into the answers
+        "selections": [""] * n,
+        "submitted": False,
+        "score": 0,
+    }
+
+
 def match_answers_ui(chapter, chapter_questions, chapter_answers):
     """Dropdown-based match-the-answer game in Streamlit."""
     state = st.session_state.tutor
@@ -364,36 +493,29 @@ def match_answers_ui(chapter, chapter_questions, chapter_answers):
     st.write("Match each question with the correct answer from the dropdowns.")
 
     # Use at most 5 pairs
-    pairs = list(zip(questions, answers))[:5]
-    correct_answers = [a for _, a in pairs]
+    n = min(len(questions), len(answers), 5)
+    correct_answers = list(islice(answers, n))
 
     # Initialise state for this challenge / chapter
     if (
-        state.get("match_answers") is None
-        or state["match_answers"].get("chapter") != chapter
+        state["match_answers"] is None
+        or state["match_answers"]["chapter"] != chapter
+        or "perm" not in state["match_answers"]
     ):
-        # Shuffle once and keep this order
-        shuffled = correct_answers.copy()
-        random.shuffle(shuffled)
-        state["match_answers"] = {
-            "chapter": chapter,
-            "options": shuffled,            # stable shuffled list
-            "selections": [""] * len(pairs),
-            "submitted": False,
-            "score": 0,
-        }
+        state["match_answers"] = _new_match_state(chapter, n)
 
     ms = state["match_answers"]
-    options = ms["options"]   # stable across reruns
+    # only the index order lives in session state; the strings are looked up here
+    options = ["Select an answer"] + [correct_answers[i] for i in ms["perm"]]
 
     # Render each question + dropdown
-    for i, (q, _) in enumerate(pairs):
-        st.markdown(f"**Q{i+1}. {q}**")
+    for i in range(n):
+        st.markdown(f"**Q{i+1}. {questions[i]}**")
         key = f"match_q_{chapter}_{i}"
 
         choice = st.selectbox(
             "Choose answer",
-            ["Select an answer"] + options,
+            options,
             key=key,
         )
         ms["selections"][i] = choice if choice != "Select an answer" else ""
@@ -403,7 +525,7 @@ def match_answers_ui(chapter, chapter_questions, chapter_answers):
         st.markdown("---")
         st.markdown("### 📊 Match Results")
 
-        for i, (_, correct) in enumerate(pairs):
+        for i, correct in enumerate(correct_answers):
             user_ans = ms["selections"][i] or "No answer selected"
             if user_ans == correct:
                 st.success(f"Q{i+1}: ✅ Correct")
@@ -414,9 +536,9 @@ def match_answers_ui(chapter, chapter_questions, chapter_answers):
         ms["submitted"] = True
         ms["score"] = score
 
-        st.markdown(f"**Final Score:** {score} / {len(pairs)}")
+        st.markdown(f"**Final Score:** {score} / {n}")
 
-        if score == len(pairs):
+        if score == n:
             award_xp("Match the Answers")
             st.success("🏆 Perfect score! XP awarded.")
         else:
@@ -424,23 +546,67 @@ def match_answers_ui(chapter, chapter_questions, chapter_answers):
 
     if ms["submitted"]:
         if st.button("Restart Match the Answers"):
-            # Re-initialise with a new shuffle
-            shuffled = correct_answers.copy()
-            random.shuffle(shuffled)
-            state["match_answers"] = {
-                "chapter": chapter,
-                "options": shuffled,
-                "selections": [""] * len(pairs),
-                "submitted": False,
-                "score": 0,
-            }
+            # Re-initialise with the next round's shuffle
+            state["match_answers"] = _new_match_state(chapter, n, ms["round"] + 1)
             st.rerun()
 
 # ----------------- TIMED QUESTION -----------------
 # ----------------- TIMED QUESTION -----------------
 
+def _timed_next():
+    timed = st.session_state.tutor["timed"]
+    timed["current_q"] += 1
+    timed["answered"] = False
+    timed["feedback"] = ""
+    timed["start_time"] = None
+
+
+def _timed_submit(q_key, correct_idx, correct):
+    """
+    Grade the timed answer. Runs as the button's callback, i.e. before the rerun,
+    so the countdown below is already created stopped once the question is answered.
+    """
+    timed = st.session_state.tutor["timed"]
+    elapsed = time.monotonic() - timed["start_time"]
+    fast_enough = elapsed <= 15
+
+    if st.session_state[f"timed_choice_{q_key}"] == correct_idx:
+        if fast_enough:
+            timed["feedback"] = f"✅ Correct in {elapsed:.1f}s! +15 XP"
+            award_xp("Timed Question")
+            timed["score"] += 15
+        else:
+            timed["feedback"] = f"✅ Correct but too slow ({elapsed:.1f}s >15s). No XP this time."
+    else:
+        timed["feedback"] = f"❌ Incorrect. Correct answer: {correct} (took {elapsed:.1f}s)."
+
+    timed["answered"] = True
+    timed["start_time"] = None
+
+
+def _timed_countdown():
+    """The countdown box; run as a fragment that reruns itself every second while the timer runs."""
+    timed = st.session_state.tutor["timed"]
+    start = timed["start_time"] if timed else None
+    if start is None:  # answered or reset: timer stopped
+        label = "--"
+    else:
+        label = f"{int(max(0, 15 - (time.monotonic() - start))):02d}s"
+    st.markdown(
+        f"""
+        <div style="text-align:center; border:1px solid #ddd; padding:8px; border-radius:8px;">
+            <div style="font-size:22px;">⏱</div>
+            <div style="font-size:20px; font-weight:bold;">{label}</div>
+            <div style="font-size:11px; color:#666;">to earn XP</div>
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
+
+
 def timed_question_ui(chapter, chapter_questions, chapter_answers):
     """Timed MCQ challenge with visible countdown + next button after feedback."""
+    _now = time.monotonic()  # one clock read per run; monotonic so clock changes can't skew it
     state = st.session_state.tutor
     questions = chapter_questions.get(chapter, [])
     answers = chapter_answers.get(chapter, [])
@@ -450,7 +616,7 @@ def timed_question_ui(chapter, chapter_questions, chapter_answers):
         return
 
     # Init state
-    if state.get("timed") is None or state["timed"].get("chapter") != chapter:
+    if state["timed"] is None or state["timed"]["chapter"] != chapter:
         state["timed"] = {
             "chapter": chapter,
             "current_q": 0,
@@ -485,13 +651,9 @@ def timed_question_ui(chapter, chapter_questions, chapter_answers):
     q = questions[idx]
     correct = answers[idx]
 
-    # Start timer
-    if timed["start_time"] is None:
-        timed["start_time"] = time.time()
-
-    elapsed_so_far = time.time() - timed["start_time"]
-    remaining = max(0, 15 - elapsed_so_far)
-    remaining_int = int(remaining)
+    # Start timer (not again once the question is answered)
+    if timed["start_time"] is None and not timed["answered"]:
+        timed["start_time"] = _now
 
     st.markdown(f"### 🕒 Timed Question {timed['current_q'] + 1} / {timed['max_q']}")
 
@@ -500,49 +662,30 @@ def timed_question_ui(chapter, chapter_questions, chapter_answers):
     with col_main:
         st.write(q)
     with col_timer:
-        st.markdown(
-            f"""
-            <div style="text-align:center; border:1px solid #ddd; padding:8px; border-radius:8px;">
-                <div style="font-size:22px;">⏱</div>
-                <div style="font-size:20px; font-weight:bold;">{remaining_int:02d}s</div>
-                <div style="font-size:11px; color:#666;">to earn XP</div>
-            </div>
-            """,
-            unsafe_allow_html=True,
-        )
+        # only tick while the question is open; a stopped timer needs no reruns
+        running = timed["start_time"] is not None
+        st.fragment(_timed_countdown, run_every=1 if running else None)()
 
     q_key = f"{chapter}_{idx}"
+    pool, idx_by_ans = _chapter_answer_pool(chapter, tuple(answers))
+    correct_idx = idx_by_ans[correct]
 
     # Build options once per question
     if q_key not in timed["options"]:
-        other_answers = [a for a in answers if a != correct]
-        distractors = random.sample(other_answers, k=min(3, len(other_answers))) if other_answers else []
-        options = [correct] + distractors
-        random.shuffle(options)
-        timed["options"][q_key] = options
+        timed["options"][q_key] = _option_indices(len(pool), correct_idx)
 
-    options = timed["options"][q_key]
-    choice = st.radio("Choose an answer:", options, key=f"timed_choice_{q_key}")
+    st.radio(
+        "Choose an answer:", timed["options"][q_key], format_func=pool.__getitem__, key=f"timed_choice_{q_key}"
+    )
 
     # Submit button logic
     if not timed["answered"]:
-        if st.button("Submit answer", key=f"timed_submit_{q_key}"):
-            end_time = time.time()
-            elapsed = end_time - timed["start_time"]
-            fast_enough = elapsed <= 15
-
-            if choice == correct:
-                if fast_enough:
-                    timed["feedback"] = f"✅ Correct in {elapsed:.1f}s! +15 XP"
-                    award_xp("Timed Question")
-                    timed["score"] += 15
-                else:
-                    timed["feedback"] = f"✅ Correct but too slow ({elapsed:.1f}s >15s). No XP this time."
-            else:
-                timed["feedback"] = f"❌ Incorrect. Correct answer: {correct} (took {elapsed:.1f}s)."
-
-            timed["answered"] = True
-            timed["start_time"] = None
+        st.button(
+            "Submit answer",
+            key=f"timed_submit_{q_key}",
+            on_click=_timed_submit,
+            args=(q_key, correct_idx, correct),
+        )
 
     # Show feedback
     if timed["answered"]:
@@ -552,16 +695,41 @@ def timed_question_ui(chapter, chapter_questions, chapter_answers):
             st.error(timed["feedback"])
 
         # Show Next button instead of resubmitting
-        if st.button("➡️ Next Question"):
-            timed["current_q"] += 1
-            timed["answered"] = False
-            timed["feedback"] = ""
-            timed["start_time"] = None
-            st.rerun()
+        st.button("➡️ Next Question", on_click=_timed_next)
 
     st.caption("Answer within 15 seconds to earn XP. Click Next to continue.")
 
 # ----------------- SCENARIO-BASED (WITH HINT) -----------------
+_SCENARIO_ROLES = ("data analyst", "IT coordinator", "junior accountant", "BI consultant")
+_SCENARIO_NAMES = ("Jordan", "Alex", "Taylor", "Sam", "Jamie", "Morgan")
+_SCENARIO_FILLER_STEPS = (
+    "Reviewed the documentation",
+    "Consulted with a senior colleague",
+    "Tested the idea on a sample dataset",
+)
+_SCENARIO_DISTRACTORS = (
+    "Skipped validation and sent the report immediately.",
+    "Ignored the data and made a decision based only on intuition.",
+    "Shared an outdated file without checking its accuracy.",
+    "Used a completely unrelated tool instead of the one covered in this chapter.",
+)
+
+_PERMS_4 = tuple(permutations(range(4)))  # all 24 orderings of the 4 distractors
+
+# chapter-dependent strings that don't change between scenarios
+_ScenarioContext = namedtuple("_ScenarioContext", "title fallback_goal hint")
+
+
+@lru_cache(maxsize=128)
+def _scenario_context(chapter) -> _ScenarioContext:
+    name = _clean_chapter_name(chapter)
+    return _ScenarioContext(
+        title=f"📘 Use Case: Applying {name}",
+        fallback_goal=f"Apply {name} in a real task",
+        hint=f"💡 Think about the main purpose of {name}: what is it supposed to help with?",
+    )
+
+
 def generate_scenario(chapter, chapter_summaries, chapter_questions, chapter_answers):
     summary = chapter_summaries.get(chapter, "No summary available.")
     questions = chapter_questions.get(chapter, [])
@@ -574,59 +742,60 @@ def generate_scenario(chapter, chapter_summaries, chapter_questions, chapter_ans
     q = questions[idx]
     a = answers[idx]
 
-    roles = ["data analyst", "IT coordinator", "junior accountant", "BI consultant"]
-    names = ["Jordan", "Alex", "Taylor", "Sam", "Jamie", "Morgan"]
-    actor = f"{random.choice(names)}, a {random.choice(roles)}"
+    ctx = _scenario_context(chapter)
+    name = random.choice(_SCENARIO_NAMES)
+    actor = f"{name}, a {random.choice(_SCENARIO_ROLES)}"
 
-    goal_text = re.sub(
-        r"(?i)\bwhat is\b|\bhow can\b|\bdescribe\b|\bexplain\b",
-        "",
-        q,
-    ).strip()
-    goal = goal_text.capitalize() or f"Apply {_clean_chapter_name(chapter)} in a real task"
+    goal_text = _QUESTION_PREFIX_RE.sub("", q).strip()
+    goal = goal_text.capitalize() or ctx.fallback_goal
 
-    base_steps = re.split(r"[.]", a)
+    base_steps = a.split(".")
     steps = [s.strip() for s in base_steps if s.strip()]
     if len(steps) < 3:
-        steps += [
-            "Reviewed the documentation",
-            "Consulted with a senior colleague",
-            "Tested the idea on a sample dataset",
-        ]
-
-    distractors = [
-        "Skipped validation and sent the report immediately.",
-        "Ignored the data and made a decision based only on intuition.",
-        "Shared an outdated file without checking its accuracy.",
-        "Used a completely unrelated tool instead of the one covered in this chapter.",
-    ]
+        steps += _SCENARIO_FILLER_STEPS
 
     correct_option = f"Applied the concepts correctly: {a}"
-    options = random.sample(distractors, k=3) + [correct_option]
-    random.shuffle(options)
+    # one draw picks a distractor ordering (r >> 2) and the answer's slot (r & 3)
+    r = random.randrange(96)
+    perm = _PERMS_4[r >> 2]
+    options = [_SCENARIO_DISTRACTORS[perm[0]], _SCENARIO_DISTRACTORS[perm[1]],
+               _SCENARIO_DISTRACTORS[perm[2]], _SCENARIO_DISTRACTORS[perm[3]]]
+    options[r & 3] = correct_option
 
     return {
-        "title": f"📘 Use Case: Applying {_clean_chapter_name(chapter)}",
+        "title": ctx.title,
         "actor": actor,
         "goal": goal,
         "summary": summary,
         "success_path": steps[:4],
-        "failure_paths": distractors,
-        "question": f"What should {actor.split(',')[0]} do next to achieve their goal?",
+        "failure_paths": list(_SCENARIO_DISTRACTORS),
+        "question": f"What should {name} do next to achieve their goal?",
         "options": options,
         "correct": correct_option,
-        "hint": f"💡 Think about the main purpose of {_clean_chapter_name(chapter)}: what is it supposed to help with?",
+        "hint": ctx.hint,
     }
 
 
+def _new_scenario(chapter, chapter_summaries, chapter_questions, chapter_answers):
+    """Regenerate a fresh scenario for this chapter (button callback)."""
+    new_scenario = generate_scenario(chapter, chapter_summaries, chapter_questions, chapter_answers)
+    if new_scenario:
+        st.session_state.tutor["scenario"] = {
+            "chapter": chapter,
+            "show_hint": False,
+            "answered": False,
+            "data": new_scenario,
+        }
+
+
 def scenario_ui(chapter, chapter_summaries, chapter_questions, chapter_answers):
     state = st.session_state.tutor
 
     # 👉 Only generate once per chapter and store in state
     if (
-        state.get("scenario") is None
-        or state["scenario"].get("chapter") != chapter
-        or state["scenario"].get("data") is None
+        state["scenario"] is None
+        or state["scenario"]["chapter"] != chapter
+        or state["scenario"]["data"] is None
     ):
         scenario = generate_scenario(chapter, chapter_summaries, chapter_questions, chapter_answers)
         if not scenario:
@@ -680,17 +849,12 @@ def scenario_ui(chapter, chapter_summaries, chapter_questions, chapter_answers):
             sc_state["show_hint"] = True
 
     with col3:
-        if st.button("🔁 New scenario", key=f"scenario_new_{chapter}"):
-            # regenerate a fresh scenario for this chapter
-            new_scenario = generate_scenario(chapter, chapter_summaries, chapter_questions, chapter_answers)
-            if new_scenario:
-                state["scenario"] = {
-                    "chapter": chapter,
-                    "show_hint": False,
-                    "answered": False,
-                    "data": new_scenario,
-                }
-                st.rerun()
+        st.button(
+            "🔁 New scenario",
+            key=f"scenario_new_{chapter}",
+            on_click=_new_scenario,
+            args=(chapter, chapter_summaries, chapter_questions, chapter_answers),
+        )
 
     if sc_state["show_hint"]:
         st.info(scenario["hint"])
@@ -698,22 +862,34 @@ def scenario_ui(chapter, chapter_summaries, chapter_questions, chapter_answers):
     with st.expander("📖 Chapter summary reminder"):
         st.write(scenario["summary"])
 
-from collections import defaultdict
-
 def compute_xp_breakdown():
     """
-    Aggregate XP per challenge type based on history strings.
-    Assumes award_xp stores entries like 'Flashcards +5 XP'.
+    XP per challenge type, as tallied by award_xp.
+    No history scan: the counter is updated when the XP is awarded.
     """
-    state = st.session_state.tutor
-    xp_by_challenge = defaultdict(int)
+    return st.session_state.tutor["xp_by_challenge"]
 
-    for entry in state["history"]:
-        for label, xp_val in XP_PER_CHALLENGE.items():
-            if entry.startswith(label):
-                xp_by_challenge[label] += xp_val
 
-    return xp_by_challenge
+@st.cache_data(ttl=300, max_entries=32)
+def _render_xp_bar(items):
+    """PNG bytes of the XP-per-challenge bar chart; items is a tuple of (label, xp)."""
+    import matplotlib.pyplot as plt  # deferred: only the dashboard plots
+
+    labels = [label for label, _ in items]
+    values = [xp for _, xp in items]
+
+    fig, ax = plt.subplots()
+    try:
+        ax.bar(labels, values)
+        ax.set_ylabel("XP")
+        ax.set_xticks(range(len(labels)))
+        ax.set_xticklabels(labels, rotation=30, ha="right")
+        ax.set_title("XP earned per challenge")
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", bbox_inches="tight")
+    finally:
+        plt.close(fig)
+    return buf.getvalue()
 
 
 def progress_dashboard_ui():
@@ -734,28 +910,20 @@ def progress_dashboard_ui():
     with col2:
         st.metric("Total XP", state["xp"])
     with col3:
-        st.metric("Challenges completed", len(state["history"]))
+        st.metric("Challenges completed", state["challenges_completed"])
 
     # XP by challenge type
     xp_breakdown = compute_xp_breakdown()
     if xp_breakdown:
         st.markdown("#### 🧩 XP by challenge type")
-        labels = list(xp_breakdown.keys())
-        values = [xp_breakdown[l] for l in labels]
-
-        fig, ax = plt.subplots()
-        ax.bar(labels, values)
-        ax.set_ylabel("XP")
-        ax.set_xticklabels(labels, rotation=30, ha="right")
-        ax.set_title("XP earned per challenge")
-        st.pyplot(fig)
+        st.image(_render_xp_bar(tuple(xp_breakdown.items())))
     else:
         st.info("Do a few challenges first and I’ll show your XP breakdown here ✨")
 
     # Recent history
     st.markdown("#### 📜 Recent activity")
     if state["history"]:
-        for h in state["history"][-10:][::-1]:
+        for h in islice(reversed(state["history"]), 10):
             st.caption("• " + h)
     else:
         st.caption("No activity yet. Try some flashcards or a quiz!")
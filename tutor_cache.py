@@ -0,0 +1,22 @@
+# tutor_cache.py — where the tutor keeps files between runs
+import os
+from typing import Optional
+
+
+def cache_path(name: str) -> Optional[str]:
+    """
+    Path for `name` in the per-user tutor cache dir, or None if it can't be created.
+
+    The dir is TUTOR_CACHE_DIR, else $XDG_CACHE_HOME/textbook_tutor (~/.cache/...),
+    and is kept at mode 0700: pickles and cached answers are read back from here,
+    so no other local user may be able to write it.
+    """
+    cache_dir = os.getenv("TUTOR_CACHE_DIR") or os.path.join(
+        os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "textbook_tutor"
+    )
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        os.chmod(cache_dir, 0o700)
+    except OSError:
+        return None
+    return os.path.join(cache_dir, name)